@@ -6,14 +6,29 @@ import base64
 import hashlib
 import hmac
 import secrets
-from flask import Flask, request, jsonify, send_from_directory, send_file
+import csv
+import io
+import math
+import functools
+import sys
+import random
+import threading
+import queue
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+import mimetypes
+from flask import Flask, request, jsonify, send_from_directory, send_file, g, Response, redirect, make_response
 from flask_cors import CORS
-from datetime import datetime, timedelta
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import safe_join
+from datetime import datetime, timedelta, timezone
 
 app = Flask(__name__, static_folder=None)
 CORS(app)
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "dmac.db")
+ARCHIVE_DB_PATH = os.environ.get("ARCHIVE_DB_PATH", os.path.join(os.path.dirname(__file__), "dmac_archive.db"))
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "..", "client", "public", "uploads")
 
 ADMIN_USERNAME = os.environ.get("ADMIN_USERNAME", "dmac")
@@ -23,8 +38,6 @@ SERVER_SECRET = os.environ.get("SESSION_SECRET", secrets.token_hex(32))
 active_sessions = {}
 MAX_IMAGE_SIZE = 5 * 1024 * 1024
 
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
 
 def get_db():
     conn = sqlite3.connect(DB_PATH)
@@ -33,6 +46,184 @@ def get_db():
     return conn
 
 
+# ============ WRITE QUEUE ============
+
+WRITE_BATCH_MAX = int(os.environ.get("WRITE_BATCH_MAX", "64"))
+WRITE_BATCH_WINDOW = float(os.environ.get("WRITE_BATCH_WINDOW_MS", "2")) / 1000.0
+WRITE_TIMEOUT = float(os.environ.get("WRITE_TIMEOUT", "30"))
+
+
+class WriteQueue:
+    """Single writer thread that group-commits queued write operations.
+
+    An operation is a callable taking the writer's connection. Operations are
+    collected into batches of up to ``batch_max`` entries or ``batch_window``
+    seconds, and each batch is committed in one transaction (one fsync).
+    Every operation runs inside its own SAVEPOINT, so a failing operation is
+    rolled back and reported to its caller without affecting the rest of the
+    batch. Operations must not call ``commit()`` themselves.
+    """
+
+    def __init__(self, db_path, batch_max=WRITE_BATCH_MAX, batch_window=WRITE_BATCH_WINDOW, on_connect=None):
+        self.db_path = db_path
+        self.on_connect = on_connect
+        self.batch_max = batch_max
+        self.batch_window = batch_window
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, op, timeout=WRITE_TIMEOUT):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((op, future))
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            # Only withdraw the op if the writer has not started it; once it
+            # is running its outcome is the caller's to wait for.
+            if future.cancel():
+                raise
+            return future.result()
+
+    def _ensure_started(self):
+        if self._running():
+            return
+        with self._lock:
+            if self._running():
+                return
+            if self._pid != os.getpid():
+                # gunicorn forks after import; a queue inherited from the
+                # parent has no writer in this process.
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self._thread.start()
+
+    def _running(self):
+        return self._thread is not None and self._pid == os.getpid() and self._thread.is_alive()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        if self.on_connect:
+            self.on_connect(conn)
+        return conn
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_max:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._commit_batch(conn, batch)
+            except Exception as e:
+                print(f"Write queue error: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                conn = self._connect()
+
+    def _commit_batch(self, conn, batch):
+        batch = [(op, future) for op, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        outcomes = []
+        for op, future in batch:
+            conn.execute("SAVEPOINT op")
+            try:
+                result = op(conn)
+            except Exception as e:
+                conn.execute("ROLLBACK TO op")
+                conn.execute("RELEASE op")
+                outcomes.append((future, None, e))
+            else:
+                conn.execute("RELEASE op")
+                outcomes.append((future, result, None))
+        try:
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+def attach_archive(conn):
+    conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_PATH,))
+    return conn
+
+
+write_queue = WriteQueue(DB_PATH, on_connect=attach_archive)
+
+
+def db_write(op):
+    """Run ``op(conn)`` on the writer thread and return its result."""
+    return write_queue.submit(op)
+
+
+def db_execute(sql, params=()):
+    """Queue a single write statement and return the affected row count."""
+    return db_write(lambda conn: conn.execute(sql, params).rowcount)
+
+
+ORDERS_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS orders (
+            id TEXT PRIMARY KEY,
+            customer_name TEXT NOT NULL,
+            customer_email TEXT NOT NULL,
+            customer_phone TEXT NOT NULL,
+            total_amount REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            poll_url TEXT,
+            paynow_reference TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS order_items (
+            id TEXT PRIMARY KEY,
+            order_id TEXT NOT NULL,
+            product_id TEXT NOT NULL,
+            product_name TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 1,
+            price REAL NOT NULL,
+            FOREIGN KEY (order_id) REFERENCES orders(id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id);
+"""
+
+
+VERSIONED_TABLES = ("services", "products", "events", "site_assets")
+VERSION_EPOCH_KEY = "_epoch"
+SERVICE_IMAGE_PREFIX = "service_img_"
+SERVICE_COLUMNS = "id, name, description, short_description, price, duration, COALESCE(image_override, image) AS image, category, featured"
+
+
+def service_image_override(value):
+    """The image a ``service_img_<id>`` asset value resolves to, if any."""
+    if isinstance(value, list) and value:
+        return value[0]
+    return None
+
+
 def init_db():
     conn = get_db()
     conn.executescript("""
@@ -45,7 +236,8 @@ def init_db():
             duration TEXT,
             image TEXT NOT NULL,
             category TEXT NOT NULL,
-            featured INTEGER DEFAULT 0
+            featured INTEGER DEFAULT 0,
+            image_override TEXT
         );
         CREATE TABLE IF NOT EXISTS products (
             id TEXT PRIMARY KEY,
@@ -56,26 +248,8 @@ def init_db():
             category TEXT NOT NULL,
             in_stock INTEGER DEFAULT 1
         );
-        CREATE TABLE IF NOT EXISTS orders (
-            id TEXT PRIMARY KEY,
-            customer_name TEXT NOT NULL,
-            customer_email TEXT NOT NULL,
-            customer_phone TEXT NOT NULL,
-            total_amount REAL NOT NULL,
-            status TEXT NOT NULL DEFAULT 'pending',
-            poll_url TEXT,
-            paynow_reference TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        CREATE TABLE IF NOT EXISTS order_items (
-            id TEXT PRIMARY KEY,
-            order_id TEXT NOT NULL,
-            product_id TEXT NOT NULL,
-            product_name TEXT NOT NULL,
-            quantity INTEGER NOT NULL DEFAULT 1,
-            price REAL NOT NULL,
-            FOREIGN KEY (order_id) REFERENCES orders(id)
-        );
+    """ + ORDERS_SCHEMA + """
+        CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at);
         CREATE TABLE IF NOT EXISTS testimonials (
             id TEXT PRIMARY KEY,
             name TEXT NOT NULL,
@@ -101,35 +275,139 @@ def init_db():
             key TEXT PRIMARY KEY,
             value TEXT NOT NULL
         );
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now'))
+        );
+    """)
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(services)")}
+    if "image_override" not in columns:
+        conn.execute("ALTER TABLE services ADD COLUMN image_override TEXT")
+        assets = conn.execute(
+            "SELECT key, value FROM site_assets WHERE key LIKE ?", (f"{SERVICE_IMAGE_PREFIX}%",)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE services SET image_override = ? WHERE id = ?",
+            [(service_image_override(json.loads(a["value"])), a["key"][len(SERVICE_IMAGE_PREFIX):]) for a in assets]
+        )
+
+    # update_site_asset keeps image_override in step for existing services;
+    # a service inserted later (e.g. by bulk import) picks up any
+    # service_img_<id> asset that is already there.
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS resolve_service_image_override AFTER INSERT ON services
+        WHEN NEW.image_override IS NULL
+        BEGIN
+            UPDATE services SET image_override = (
+                SELECT json_extract(value, '$[0]') FROM site_assets
+                WHERE key = '{SERVICE_IMAGE_PREFIX}' || NEW.id AND json_type(value) = 'array'
+            )
+            WHERE id = NEW.id;
+        END
     """)
+
+    # A random epoch, fixed when this database's version rows are first
+    # created, so counters restarting from 0 in a recreated or upgraded
+    # database never reproduce an ETag handed out for different content.
+    conn.execute(
+        "INSERT OR IGNORE INTO table_versions (name, version) VALUES (?, ?)",
+        (VERSION_EPOCH_KEY, secrets.randbits(62))
+    )
+    # Every write to a versioned table bumps its counter in the same
+    # transaction, whichever code path made it.
+    for table in VERSIONED_TABLES:
+        conn.execute("INSERT OR IGNORE INTO table_versions (name) VALUES (?)", (table,))
+        for op in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS bump_{table}_{op.lower()} AFTER {op} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1, updated_at = strftime('%s', 'now')
+                    WHERE name = '{table}';
+                END
+            """)
     conn.commit()
     conn.close()
 
 
+def init_archive_db():
+    conn = sqlite3.connect(ARCHIVE_DB_PATH)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(ORDERS_SCHEMA)
+    conn.commit()
+    conn.close()
+
+
+# ============ ORDER ARCHIVAL ============
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "500"))
+# paynow_result stores whatever status Paynow reports, so "settled" is
+# defined as anything not still waiting on the customer or the gateway.
+OPEN_ORDER_STATUSES = ("pending", "pending_payment", "awaiting_payment", "created", "sent")
+
+
+def archive_settled_orders(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move settled orders older than ``older_than_days`` into the archive db.
+
+    Each batch is copied in one transaction and deleted from the live tables
+    in the next. With WAL a commit spanning attached databases is not atomic
+    across files, so the delete only removes rows already present in the
+    archive and the copy uses INSERT OR REPLACE; a crash between the two
+    steps is repaired by the next run.
+    """
+    status_placeholders = ",".join("?" for _ in OPEN_ORDER_STATUSES)
+    cutoff = f"-{int(older_than_days)} days"
+    moved = 0
+    while True:
+        conn = get_db()
+        ids = [r["id"] for r in conn.execute(
+            f"SELECT id FROM orders WHERE status NOT IN ({status_placeholders}) AND created_at < datetime('now', ?) ORDER BY created_at LIMIT ?",
+            (*OPEN_ORDER_STATUSES, cutoff, batch_size)
+        ).fetchall()]
+        conn.close()
+        if not ids:
+            break
+        placeholders = ",".join("?" for _ in ids)
+
+        def copy_batch(conn):
+            conn.execute(f"INSERT OR REPLACE INTO archive.orders SELECT * FROM main.orders WHERE id IN ({placeholders})", ids)
+            conn.execute(f"INSERT OR REPLACE INTO archive.order_items SELECT * FROM main.order_items WHERE order_id IN ({placeholders})", ids)
+
+        def delete_batch(conn):
+            archived = f"id IN ({placeholders}) AND id IN (SELECT id FROM archive.orders)"
+            conn.execute(f"DELETE FROM main.order_items WHERE order_id IN (SELECT id FROM main.orders WHERE {archived})", ids)
+            return conn.execute(f"DELETE FROM main.orders WHERE {archived}", ids).rowcount
+
+        db_write(copy_batch)
+        deleted = db_write(delete_batch)
+        moved += deleted
+        if deleted < len(ids):
+            break
+    return moved
+
+
 def cleanup_expired_events():
     try:
         conn = get_db()
         now = datetime.now()
         now_str = now.strftime("%Y-%m-%d %H:%M")
-        rows = conn.execute("SELECT id, date, end_time, images FROM events").fetchall()
+        rows = conn.execute(
+            "SELECT id, images FROM events WHERE date || ' ' || end_time < ?", (now_str,)
+        ).fetchall()
         deleted_ids = []
         for row in rows:
-            event_end = f"{row['date']} {row['end_time']}"
             try:
-                if event_end < now_str:
-                    deleted_ids.append(row['id'])
-                    images = json.loads(row['images'] or '[]')
-                    for img_path in images:
-                        full_path = os.path.join(os.path.dirname(__file__), "..", "client", "public", img_path.lstrip("/"))
-                        if os.path.exists(full_path):
-                            os.remove(full_path)
+                deleted_ids.append(row['id'])
+                images = json.loads(row['images'] or '[]')
+                for img_path in images:
+                    delete_upload(img_path)
             except Exception:
                 pass
+        conn.close()
         if deleted_ids:
             placeholders = ",".join("?" for _ in deleted_ids)
-            conn.execute(f"DELETE FROM events WHERE id IN ({placeholders})", deleted_ids)
-            conn.commit()
-        conn.close()
+            db_execute(f"DELETE FROM events WHERE id IN ({placeholders})", deleted_ids)
     except Exception as e:
         print(f"Cleanup error: {e}")
 
@@ -250,60 +528,531 @@ def check_admin_auth():
     return True
 
 
+# ============ UPLOAD STORAGE ============
+
+UPLOAD_STORAGE = os.environ.get("UPLOAD_STORAGE", "local").lower()
+UPLOAD_URL_PREFIX = "/uploads/"
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class LocalStorage:
+    """Uploads stored in a directory on this node."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name):
+        path = safe_join(self.root, name)
+        if path is None:
+            raise ValueError(f"Invalid upload name: {name!r}")
+        return path
+
+    def save(self, name, fileobj, content_type=None):
+        path = self.path(name)
+        tmp_path = f"{path}.{uuid.uuid4().hex[:6]}.tmp"
+        with open(tmp_path, "wb") as f:
+            while True:
+                block = fileobj.read(STREAM_CHUNK_SIZE)
+                if not block:
+                    break
+                f.write(block)
+        os.replace(tmp_path, path)
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def serve(self, name):
+        # send_from_directory rejects path traversal and answers Range and
+        # conditional requests itself.
+        return send_from_directory(self.root, name)
+
+
+class S3Storage:
+    """Uploads stored in an S3-compatible bucket (AWS S3, MinIO, R2, ...).
+
+    Credentials come from the usual AWS_* environment variables. With
+    ``redirect`` enabled, reads answer with a 302 to a presigned URL so the
+    image bytes never pass through the app; otherwise the object is streamed
+    through, forwarding any Range header.
+    """
+
+    def __init__(self, bucket, prefix="uploads/", endpoint_url=None, region=None, redirect=True, url_expires=3600):
+        import boto3
+        from botocore.exceptions import ClientError
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.redirect = redirect
+        self.url_expires = url_expires
+        self.client_error = ClientError
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None, region_name=region or None)
+
+    def key(self, name):
+        if ".." in name.split("/") or "\\" in name:
+            raise ValueError(f"Invalid upload name: {name!r}")
+        return f"{self.prefix}{name}"
+
+    def save(self, name, fileobj, content_type=None):
+        extra = {"ContentType": content_type} if content_type else None
+        self.client.upload_fileobj(fileobj, self.bucket, self.key(name), ExtraArgs=extra)
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def serve(self, name):
+        try:
+            key = self.key(name)
+        except ValueError:
+            return "Not found", 404
+        if self.redirect:
+            url = self.client.generate_presigned_url(
+                "get_object",
+                Params={"Bucket": self.bucket, "Key": key},
+                ExpiresIn=self.url_expires,
+            )
+            return redirect(url, code=302)
+
+        params = {"Bucket": self.bucket, "Key": key}
+        if request.headers.get("Range"):
+            params["Range"] = request.headers["Range"]
+        try:
+            obj = self.client.get_object(**params)
+        except self.client_error as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code in ("NoSuchKey", "404"):
+                return "Not found", 404
+            if code == "InvalidRange":
+                return "Range not satisfiable", 416
+            raise
+        headers = {"Accept-Ranges": "bytes", "Content-Length": str(obj["ContentLength"])}
+        if obj.get("ContentRange"):
+            headers["Content-Range"] = obj["ContentRange"]
+        if obj.get("ETag"):
+            headers["ETag"] = obj["ETag"]
+        return Response(
+            obj["Body"].iter_chunks(STREAM_CHUNK_SIZE),
+            status=206 if obj.get("ContentRange") else 200,
+            mimetype=obj.get("ContentType") or mimetypes.guess_type(name)[0],
+            headers=headers,
+        )
+
+
+def create_storage():
+    if UPLOAD_STORAGE == "s3":
+        return S3Storage(
+            os.environ["S3_BUCKET"],
+            prefix=os.environ.get("S3_PREFIX", "uploads/"),
+            endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+            region=os.environ.get("S3_REGION"),
+            redirect=os.environ.get("S3_REDIRECT", "1").lower() in ("1", "true", "yes"),
+            url_expires=int(os.environ.get("S3_URL_EXPIRES", "3600")),
+        )
+    return LocalStorage(UPLOAD_DIR)
+
+
+storage = create_storage()
+
+
+def save_data_url_image(data_url, stem):
+    """Decode a base64 data URL and store it; returns its /uploads/ URL."""
+    header, b64 = data_url.split(",", 1)
+    raw = base64.b64decode(b64)
+    if len(raw) > MAX_IMAGE_SIZE:
+        return None
+    ext = "jpg"
+    if "png" in header:
+        ext = "png"
+    elif "webp" in header:
+        ext = "webp"
+    filename = f"{stem}.{ext}"
+    storage.save(filename, io.BytesIO(raw), mimetypes.guess_type(filename)[0])
+    return f"{UPLOAD_URL_PREFIX}{filename}"
+
+
+def delete_upload(url):
+    if isinstance(url, str) and url.startswith(UPLOAD_URL_PREFIX):
+        try:
+            storage.delete(url[len(UPLOAD_URL_PREFIX):])
+        except ValueError as e:
+            print(f"Refusing to delete upload: {e}")
+        except Exception as e:
+            # A storage outage must not fail the row update or delete the
+            # upload belongs to; the file is just left behind.
+            print(f"Upload delete error: {e}")
+
+
+# ============ PROFILING ============
+
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL_MS", "5")) / 1000.0
+PROFILE_BUFFER_SIZE = int(os.environ.get("PROFILE_BUFFER_SIZE", "50"))
+
+
+class StackSampler:
+    """Samples the Python stacks of registered request threads.
+
+    A single background thread runs only while at least one request is being
+    profiled, and records each sampled stack in collapsed form
+    (``root;caller;callee``) so the counts can be fed straight into
+    flamegraph.pl or speedscope.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, thread_id):
+        counts = Counter()
+        with self._lock:
+            self._active[thread_id] = counts
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+        return counts
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._active.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            frames = sys._current_frames()
+            # Counters are only written under the lock, so once stop() has
+            # returned the caller owns its Counter outright.
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                for thread_id, counts in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        counts[collapse_stack(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+def collapse_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+stack_sampler = StackSampler()
+request_profiles = deque(maxlen=PROFILE_BUFFER_SIZE)
+request_profiles_lock = threading.Lock()
+
+
+def start_request_profile():
+    forced = request.headers.get("X-Profile") == "1" and check_admin_auth()
+    if not forced and random.random() >= PROFILE_SAMPLE_RATE:
+        return
+    g.profile_started = time.perf_counter()
+    g.profile_counts = stack_sampler.start(threading.get_ident())
+
+
+def finish_request_profile(exc=None):
+    started = g.pop("profile_started", None)
+    if started is None:
+        return
+    stack_sampler.stop(threading.get_ident())
+    counts = g.pop("profile_counts")
+    profile = {
+        "id": uuid.uuid4().hex[:12],
+        "method": request.method,
+        "path": request.path,
+        "durationMs": round((time.perf_counter() - started) * 1000, 2),
+        "samples": sum(counts.values()),
+        "error": str(exc) if exc else None,
+        "createdAt": datetime.now().isoformat(timespec="seconds"),
+        "stacks": counts,
+    }
+    with request_profiles_lock:
+        request_profiles.append(profile)
+
+
+# Hooks are only installed when profiling is enabled, so requests pay
+# nothing for it otherwise.
+if PROFILING_ENABLED:
+    app.before_request(start_request_profile)
+    app.teardown_request(finish_request_profile)
+
+
+# ============ RATE LIMITING ============
+
+def parse_rate(spec):
+    """Parse ``"count/seconds"`` into (burst capacity, tokens per second)."""
+    count, seconds = spec.split("/")
+    return float(count), float(count) / float(seconds)
+
+
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_DB_PATH = os.environ.get("RATE_LIMIT_DB_PATH", os.path.join(os.path.dirname(__file__), "rate_limits.db"))
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "0"))
+MAX_EXPENSIVE_REQUESTS = int(os.environ.get("MAX_EXPENSIVE_REQUESTS", "8"))
+
+RATE_LIMITS = {
+    "checkout": parse_rate(os.environ.get("RATE_LIMIT_CHECKOUT", "10/60")),
+    "login": parse_rate(os.environ.get("RATE_LIMIT_LOGIN", "5/60")),
+    "upload": parse_rate(os.environ.get("RATE_LIMIT_UPLOAD", "30/60")),
+}
+
+# endpoint -> (rate limit bucket, counts against the concurrency cap)
+ROUTE_LIMITS = {
+    "checkout": ("checkout", True),
+    "admin_login": ("login", False),
+    "create_event": ("upload", True),
+    "update_event": ("upload", True),
+    "update_site_asset": ("upload", True),
+    "bulk_import": ("upload", True),
+}
+
+
+class MemoryTokenBuckets:
+    """Token buckets kept in this worker's memory."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+
+    def take(self, key, capacity, rate):
+        """Take one token; return 0 if allowed, else seconds until one is free."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / rate
+            if now - self._last_prune > 60:
+                self._prune(now)
+        return wait
+
+    def _prune(self, now):
+        # Buckets idle long enough to have refilled are indistinguishable
+        # from new ones, so they can go.
+        idle = [k for k, (_, updated) in self._buckets.items() if now - updated > 3600]
+        for k in idle:
+            del self._buckets[k]
+        self._last_prune = now
+
+
+class SQLiteTokenBuckets:
+    """Token buckets shared by every worker through a small SQLite file.
+
+    Each take is a single UPSERT ... RETURNING statement, so concurrent
+    workers cannot both spend the same token.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS rate_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("PRAGMA busy_timeout=2000")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, capacity, rate):
+        now = time.time()
+        conn = self._conn()
+        refilled = "min(:capacity, tokens + (:now - updated) * :rate)"
+        row = conn.execute(
+            f"""INSERT INTO rate_buckets (key, tokens, updated) VALUES (:key, :capacity - 1, :now)
+                ON CONFLICT(key) DO UPDATE SET tokens = {refilled} - 1, updated = :now
+                WHERE {refilled} >= 1
+                RETURNING tokens""",
+            {"key": key, "capacity": capacity, "rate": rate, "now": now}
+        ).fetchone()
+        if row is not None:
+            return 0
+        tokens = conn.execute(
+            f"SELECT {refilled} FROM rate_buckets WHERE key = :key",
+            {"key": key, "capacity": capacity, "rate": rate, "now": now}
+        ).fetchone()[0]
+        return max((1 - tokens) / rate, 0.001)
+
+
+rate_buckets = SQLiteTokenBuckets(RATE_LIMIT_DB_PATH) if RATE_LIMIT_BACKEND == "sqlite" else MemoryTokenBuckets()
+expensive_slots = threading.BoundedSemaphore(MAX_EXPENSIVE_REQUESTS)
+
+
+# Only the X-Forwarded-For entries appended by our own proxies can be
+# trusted; anything to their left is whatever the client chose to send.
+# ProxyFix takes the address added by the outermost trusted hop.
+if TRUSTED_PROXY_HOPS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
+
+_warned_untrusted_proxy = False
+
+
+def client_ip():
+    global _warned_untrusted_proxy
+    if not TRUSTED_PROXY_HOPS and not _warned_untrusted_proxy and request.headers.get("X-Forwarded-For"):
+        _warned_untrusted_proxy = True
+        print("Rate limiting: requests carry X-Forwarded-For but TRUSTED_PROXY_HOPS is 0; "
+              "every client behind the proxy shares one bucket")
+    return request.remote_addr or "unknown"
+
+
+@app.before_request
+def enforce_rate_limits():
+    # CORS preflights are answered without running the view, so they must
+    # not spend the client's budget.
+    if request.method == "OPTIONS":
+        return None
+    limits = ROUTE_LIMITS.get(request.endpoint)
+    if limits is None:
+        return None
+    bucket, expensive = limits
+    capacity, rate = RATE_LIMITS[bucket]
+    try:
+        wait = rate_buckets.take(f"{bucket}:{client_ip()}", capacity, rate)
+    except sqlite3.Error as e:
+        # Fail open: a broken limiter store must not take checkout down.
+        print(f"Rate limit error: {e}")
+        wait = 0
+    if wait:
+        response = jsonify({"error": "Too many requests. Please try again shortly."})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(math.ceil(wait))
+        return response
+    if expensive:
+        if not expensive_slots.acquire(blocking=False):
+            response = jsonify({"error": "Server is busy. Please try again shortly."})
+            response.status_code = 503
+            response.headers["Retry-After"] = "1"
+            return response
+        g.holds_expensive_slot = True
+    return None
+
+
+@app.teardown_request
+def release_expensive_slot(exc=None):
+    if g.pop("holds_expensive_slot", False):
+        expensive_slots.release()
+
+
+# ============ CONDITIONAL GET ============
+
+# Browsers always revalidate (a cheap 304 once nothing has changed); a CDN
+# in front may hold responses for s-maxage and serve stale copies while it
+# revalidates in the background.
+CATALOG_CACHE_CONTROL = "public, max-age=0, s-maxage=60, stale-while-revalidate=300"
+EVENTS_CACHE_CONTROL = "public, max-age=0, s-maxage=30, stale-while-revalidate=60"
+
+
+def read_table_versions(tables):
+    """Return the database epoch and a (version, updated_at) pair per table."""
+    names = (VERSION_EPOCH_KEY, *tables)
+    conn = get_db()
+    rows = conn.execute(
+        f"SELECT name, version, updated_at FROM table_versions WHERE name IN ({','.join('?' for _ in names)})",
+        names
+    ).fetchall()
+    conn.close()
+    versions = {row["name"]: (row["version"], row["updated_at"]) for row in rows}
+    epoch = versions.get(VERSION_EPOCH_KEY, (0, 0))[0]
+    return epoch, [versions.get(t, (0, 0)) for t in tables]
+
+
+def conditional_get(*tables, cache_control=CATALOG_CACHE_CONTROL, prepare=None):
+    """Serve ETag/Last-Modified from table versions and answer 304s early.
+
+    The validators are derived only from the database epoch and the version
+    counters of ``tables``, so a matching If-None-Match is answered before the
+    view runs any query or serialization. Last-Modified is sent for
+    information only; 304s are decided by the ETag alone. ``prepare`` runs first for views
+    whose data can change without an explicit write, like expired events.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if prepare:
+                prepare()
+            epoch, versions = read_table_versions(tables)
+            etag = f"{epoch:x}-" + ".".join(str(version) for version, _ in versions)
+            last_modified = datetime.fromtimestamp(max(updated for _, updated in versions), timezone.utc)
+
+            # RFC 9110 uses weak comparison for If-None-Match; proxies that
+            # compress responses hand back W/"..." validators. If-Modified-Since
+            # is deliberately ignored: updated_at has one-second resolution,
+            # so a second write within the same second would still match.
+            not_modified = request.if_none_match.contains_weak(etag)
+
+            response = Response(status=304) if not_modified else make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+                response.last_modified = last_modified
+                response.headers["Cache-Control"] = cache_control
+            return response
+        return wrapper
+    return decorator
+
+
+def run_event_cleanup():
+    try:
+        cleanup_expired_events()
+    except Exception as e:
+        print(f"Auto-cleanup error: {e}")
+
+
 # ============ API ROUTES ============
 
 @app.route("/api/services", methods=["GET"])
+@conditional_get("services")
 def get_services():
+    # Image overrides from service_img_* assets are kept resolved in
+    # services.image_override by update_site_asset.
     conn = get_db()
-    rows = conn.execute("SELECT * FROM services").fetchall()
+    rows = conn.execute(f"SELECT {SERVICE_COLUMNS} FROM services").fetchall()
     conn.close()
     services = []
-    
-    # Get custom service images from assets if they exist
-    # Mapping service names to asset keys
-    conn = get_db()
-    assets_rows = conn.execute("SELECT * FROM site_assets WHERE key LIKE 'service_img_%'").fetchall()
-    conn.close()
-    service_assets = {row["key"]: json.loads(row["value"]) for row in assets_rows}
-
     for r in rows:
         d = row_to_dict(r)
         d["featured"] = bool(d["featured"])
         d["shortDescription"] = d.pop("short_description")
-        
-        # Check for dynamic image override
-        asset_key = f"service_img_{d['id']}"
-        if asset_key in service_assets and service_assets[asset_key]:
-            d["image"] = service_assets[asset_key][0]
-            
         services.append(d)
     return jsonify(services)
 
 
 @app.route("/api/services/<service_id>", methods=["GET"])
+@conditional_get("services")
 def get_service(service_id):
     conn = get_db()
-    row = conn.execute("SELECT * FROM services WHERE id = ?", (service_id,)).fetchone()
+    row = conn.execute(f"SELECT {SERVICE_COLUMNS} FROM services WHERE id = ?", (service_id,)).fetchone()
     conn.close()
     if not row:
         return jsonify({"message": "Service not found"}), 404
     d = row_to_dict(row)
     d["featured"] = bool(d["featured"])
     d["shortDescription"] = d.pop("short_description")
-    
-    # Check for dynamic image override
-    conn = get_db()
-    asset_row = conn.execute("SELECT value FROM site_assets WHERE key = ?", (f"service_img_{service_id}",)).fetchone()
-    conn.close()
-    if asset_row:
-        val = json.loads(asset_row["value"])
-        if val:
-            d["image"] = val[0]
-            
     return jsonify(d)
 
 
 @app.route("/api/products", methods=["GET"])
+@conditional_get("products")
 def get_products():
     conn = get_db()
     rows = conn.execute("SELECT * FROM products").fetchall()
@@ -317,6 +1066,7 @@ def get_products():
 
 
 @app.route("/api/products/<product_id>", methods=["GET"])
+@conditional_get("products")
 def get_product(product_id):
     conn = get_db()
     row = conn.execute("SELECT * FROM products WHERE id = ?", (product_id,)).fetchone()
@@ -339,13 +1089,8 @@ def get_testimonials():
 # ============ EVENTS API ============
 
 @app.route("/api/events", methods=["GET"])
+@conditional_get("events", cache_control=EVENTS_CACHE_CONTROL, prepare=run_event_cleanup)
 def get_events():
-    # Auto-cleanup expired events before fetching
-    try:
-        cleanup_expired_events()
-    except Exception as e:
-        print(f"Auto-cleanup error: {e}")
-
     conn = get_db()
     rows = conn.execute("SELECT * FROM events ORDER BY date ASC, start_time ASC").fetchall()
     conn.close()
@@ -362,6 +1107,7 @@ def get_events():
 
 
 @app.route("/api/events/<event_id>", methods=["GET"])
+@conditional_get("events", cache_control=EVENTS_CACHE_CONTROL)
 def get_event(event_id):
     conn = get_db()
     row = conn.execute("SELECT * FROM events WHERE id = ?", (event_id,)).fetchone()
@@ -415,31 +1161,17 @@ def create_event():
     saved_images = []
     for i, img_data in enumerate(images[:5]):
         if img_data.startswith("data:"):
-            header, b64 = img_data.split(",", 1)
-            raw = base64.b64decode(b64)
-            if len(raw) > MAX_IMAGE_SIZE:
-                continue
-            ext = "jpg"
-            if "png" in header:
-                ext = "png"
-            elif "webp" in header:
-                ext = "webp"
-            filename = f"event_{event_id}_{i}.{ext}"
-            filepath = os.path.join(UPLOAD_DIR, filename)
-            with open(filepath, "wb") as f:
-                f.write(raw)
-            saved_images.append(f"/uploads/{filename}")
+            url = save_data_url_image(img_data, f"event_{event_id}_{i}")
+            if url:
+                saved_images.append(url)
         elif img_data.startswith("/uploads/"):
             saved_images.append(img_data)
 
     try:
-        conn = get_db()
-        conn.execute(
+        db_execute(
             "INSERT INTO events (id, title, description, venue, date, start_time, end_time, category, ticket_price, capacity, images) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
             (event_id, title, description, venue, date, start_time, end_time, category, ticket_price, capacity, json.dumps(saved_images))
         )
-        conn.commit()
-        conn.close()
         print(f"Successfully created event {event_id}")
     except Exception as e:
         print(f"Database error during event creation: {e}")
@@ -455,8 +1187,8 @@ def update_event(event_id):
 
     conn = get_db()
     existing = conn.execute("SELECT * FROM events WHERE id = ?", (event_id,)).fetchone()
+    conn.close()
     if not existing:
-        conn.close()
         return jsonify({"error": "Event not found"}), 404
 
     data = request.get_json()
@@ -477,37 +1209,22 @@ def update_event(event_id):
         saved_images = []
         for i, img_data in enumerate(images[:5]):
             if img_data.startswith("data:"):
-                header, b64 = img_data.split(",", 1)
-                raw = base64.b64decode(b64)
-                if len(raw) > MAX_IMAGE_SIZE:
-                    continue
-                ext = "jpg"
-                if "png" in header:
-                    ext = "png"
-                elif "webp" in header:
-                    ext = "webp"
-                filename = f"event_{event_id}_{i}_{uuid.uuid4().hex[:6]}.{ext}"
-                filepath = os.path.join(UPLOAD_DIR, filename)
-                with open(filepath, "wb") as f:
-                    f.write(raw)
-                saved_images.append(f"/uploads/{filename}")
+                url = save_data_url_image(img_data, f"event_{event_id}_{i}_{uuid.uuid4().hex[:6]}")
+                if url:
+                    saved_images.append(url)
             elif img_data.startswith("/uploads/"):
                 saved_images.append(img_data)
 
         for old_img in old_images:
             if old_img not in saved_images:
-                full_path = os.path.join(os.path.dirname(__file__), "..", "client", "public", old_img.lstrip("/"))
-                if os.path.exists(full_path):
-                    os.remove(full_path)
+                delete_upload(old_img)
     else:
         saved_images = old_images
 
-    conn.execute(
+    db_execute(
         "UPDATE events SET title=?, description=?, venue=?, date=?, start_time=?, end_time=?, category=?, ticket_price=?, capacity=?, images=? WHERE id=?",
         (title, description, venue, date, start_time, end_time, category, ticket_price, capacity, json.dumps(saved_images), event_id)
     )
-    conn.commit()
-    conn.close()
 
     return jsonify({"id": event_id, "success": True})
 
@@ -519,26 +1236,55 @@ def delete_event(event_id):
 
     conn = get_db()
     row = conn.execute("SELECT images FROM events WHERE id = ?", (event_id,)).fetchone()
+    conn.close()
     if not row:
-        conn.close()
         return jsonify({"error": "Event not found"}), 404
 
     images = json.loads(row["images"] or "[]")
     for img_path in images:
-        full_path = os.path.join(os.path.dirname(__file__), "..", "client", "public", img_path.lstrip("/"))
-        if os.path.exists(full_path):
-            os.remove(full_path)
+        delete_upload(img_path)
 
-    conn.execute("DELETE FROM events WHERE id = ?", (event_id,))
-    conn.commit()
-    conn.close()
+    db_execute("DELETE FROM events WHERE id = ?", (event_id,))
+
+    return jsonify({"success": True})
 
+
+@app.route("/api/admin/profiles", methods=["GET"])
+def list_profiles():
+    if not check_admin_auth():
+        return jsonify({"error": "Unauthorized"}), 401
+    with request_profiles_lock:
+        snapshot = list(request_profiles)
+    profiles = [{k: v for k, v in p.items() if k != "stacks"} for p in reversed(snapshot)]
+    return jsonify({"enabled": PROFILING_ENABLED, "sampleRate": PROFILE_SAMPLE_RATE, "profiles": profiles})
+
+
+@app.route("/api/admin/profiles/<profile_id>", methods=["GET"])
+def get_profile(profile_id):
+    if not check_admin_auth():
+        return jsonify({"error": "Unauthorized"}), 401
+    with request_profiles_lock:
+        snapshot = list(request_profiles)
+    for p in snapshot:
+        if p["id"] == profile_id:
+            body = "".join(f"{stack} {count}\n" for stack, count in p["stacks"].most_common())
+            return body, 200, {"Content-Type": "text/plain; charset=utf-8"}
+    return jsonify({"error": "Profile not found"}), 404
+
+
+@app.route("/api/admin/profiles", methods=["DELETE"])
+def clear_profiles():
+    if not check_admin_auth():
+        return jsonify({"error": "Unauthorized"}), 401
+    with request_profiles_lock:
+        request_profiles.clear()
     return jsonify({"success": True})
 
 
 # ============ SITE ASSETS API ============
 
 @app.route("/api/assets", methods=["GET"])
+@conditional_get("site_assets")
 def get_site_assets():
     conn = get_db()
     rows = conn.execute("SELECT * FROM site_assets").fetchall()
@@ -563,36 +1309,316 @@ def update_site_asset():
     if isinstance(value, list):
         for i, item in enumerate(value):
             if isinstance(item, str) and item.startswith("data:"):
-                header, b64 = item.split(",", 1)
-                raw = base64.b64decode(b64)
-                if len(raw) > MAX_IMAGE_SIZE:
-                    continue
-                ext = "jpg"
-                if "png" in header:
-                    ext = "png"
-                elif "webp" in header:
-                    ext = "webp"
-                filename = f"asset_{key}_{i}_{uuid.uuid4().hex[:6]}.{ext}"
-                filepath = os.path.join(UPLOAD_DIR, filename)
-                with open(filepath, "wb") as f:
-                    f.write(raw)
-                processed_value.append(f"/uploads/{filename}")
+                url = save_data_url_image(item, f"asset_{key}_{i}_{uuid.uuid4().hex[:6]}")
+                if url:
+                    processed_value.append(url)
             else:
                 processed_value.append(item)
     else:
         processed_value = value
 
-    conn = get_db()
-    conn.execute(
-        "INSERT OR REPLACE INTO site_assets (key, value) VALUES (?, ?)",
-        (key, json.dumps(processed_value))
-    )
-    conn.commit()
-    conn.close()
+    def save_asset(conn):
+        conn.execute(
+            "INSERT OR REPLACE INTO site_assets (key, value) VALUES (?, ?)",
+            (key, json.dumps(processed_value))
+        )
+        if key.startswith(SERVICE_IMAGE_PREFIX):
+            conn.execute(
+                "UPDATE services SET image_override = ? WHERE id = ?",
+                (service_image_override(processed_value), key[len(SERVICE_IMAGE_PREFIX):])
+            )
+
+    db_write(save_asset)
 
     return jsonify({"success": True, "value": processed_value})
 
 
+# ============ BULK IMPORT / EXPORT ============
+
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", "500"))
+BULK_MAX_ERRORS = 100
+REQUIRED = object()
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "y")
+
+
+def parse_date(value):
+    # Normalised to YYYY-MM-DD because cleanup_expired_events compares
+    # "date end_time" as a string.
+    return datetime.strptime(str(value).strip(), "%Y-%m-%d").strftime("%Y-%m-%d")
+
+
+def parse_time(value):
+    return datetime.strptime(str(value).strip(), "%H:%M").strftime("%H:%M")
+
+
+BULK_IMAGE_PREFIXES = ("/uploads/", "/images/")
+
+
+def is_bulk_image_path(path):
+    return (
+        isinstance(path, str)
+        and path.startswith(BULK_IMAGE_PREFIXES)
+        and "\\" not in path
+        and ".." not in path.split("/")
+    )
+
+
+def parse_images(value):
+    if isinstance(value, str):
+        value = json.loads(value) if value.strip() else []
+    if not isinstance(value, list) or not all(is_bulk_image_path(v) for v in value):
+        raise ValueError("images must be a list of /uploads/ or /images/ paths")
+    return json.dumps(value[:5])
+
+
+# (column, API key, parser, default)
+BULK_ENTITIES = {
+    "services": [
+        ("id", "id", str, None),
+        ("name", "name", str, REQUIRED),
+        ("description", "description", str, REQUIRED),
+        ("short_description", "shortDescription", str, REQUIRED),
+        ("price", "price", float, 0),
+        ("duration", "duration", str, None),
+        ("image", "image", str, REQUIRED),
+        ("category", "category", str, REQUIRED),
+        ("featured", "featured", parse_bool, False),
+    ],
+    "products": [
+        ("id", "id", str, None),
+        ("name", "name", str, REQUIRED),
+        ("description", "description", str, REQUIRED),
+        ("price", "price", float, REQUIRED),
+        ("image", "image", str, REQUIRED),
+        ("category", "category", str, REQUIRED),
+        ("in_stock", "inStock", parse_bool, True),
+    ],
+    "events": [
+        ("id", "id", str, None),
+        ("title", "title", str, REQUIRED),
+        ("description", "description", str, REQUIRED),
+        ("venue", "venue", str, REQUIRED),
+        ("date", "date", parse_date, REQUIRED),
+        ("start_time", "startTime", parse_time, REQUIRED),
+        ("end_time", "endTime", parse_time, REQUIRED),
+        ("category", "category", str, "General"),
+        ("ticket_price", "ticketPrice", float, 0),
+        ("capacity", "capacity", int, 0),
+        ("images", "images", parse_images, "[]"),
+    ],
+}
+
+
+def validate_bulk_row(fields, record):
+    if not isinstance(record, dict):
+        raise ValueError("row must be an object")
+    values = []
+    for column, key, parse, default in fields:
+        value = record.get(key)
+        if value is None or value == "":
+            if default is REQUIRED:
+                raise ValueError(f"missing {key}")
+            value = str(uuid.uuid4()) if column == "id" else default
+        else:
+            try:
+                value = parse(value)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"invalid {key}: {e}")
+        values.append(value)
+    return tuple(values)
+
+
+def bulk_row_to_dict(fields, row):
+    d = {}
+    for column, key, parse, _ in fields:
+        value = row[column]
+        if parse is parse_bool:
+            value = bool(value)
+        elif parse is parse_images:
+            value = json.loads(value or "[]")
+        d[key] = value
+    return d
+
+
+def iter_request_lines(chunk_size=65536):
+    """Yield the request body line by line without buffering it whole."""
+    pending = b""
+    while True:
+        chunk = request.stream.read(chunk_size)
+        if not chunk:
+            break
+        *lines, pending = (pending + chunk).split(b"\n")
+        for line in lines:
+            yield (line + b"\n").decode("utf-8-sig")
+    if pending:
+        yield pending.decode("utf-8-sig")
+
+
+def bulk_format():
+    fmt = request.args.get("format")
+    if fmt:
+        return fmt.lower()
+    return "csv" if "csv" in (request.content_type or "") else "ndjson"
+
+
+def iter_bulk_records(fmt):
+    if fmt == "csv":
+        yield from enumerate(csv.DictReader(iter_request_lines()), start=1)
+        return
+    row_num = 0
+    for line in iter_request_lines():
+        if not line.strip():
+            continue
+        row_num += 1
+        try:
+            yield row_num, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_num, ValueError(f"invalid JSON: {e.msg}")
+
+
+def insert_bulk_chunk(sql, chunk):
+    """Insert a chunk with executemany, retrying row by row if any row fails."""
+    def op(conn):
+        conn.execute("SAVEPOINT chunk")
+        try:
+            conn.executemany(sql, [values for _, values in chunk])
+        except sqlite3.Error:
+            conn.execute("ROLLBACK TO chunk")
+            conn.execute("RELEASE chunk")
+        else:
+            conn.execute("RELEASE chunk")
+            return []
+        failures = []
+        for row_num, values in chunk:
+            try:
+                conn.execute(sql, values)
+            except sqlite3.Error as e:
+                failures.append((row_num, str(e)))
+        return failures
+    return db_write(op)
+
+
+@app.route("/api/admin/bulk/<entity>", methods=["POST"])
+def bulk_import(entity):
+    if not check_admin_auth():
+        return jsonify({"error": "Unauthorized"}), 401
+    fields = BULK_ENTITIES.get(entity)
+    if fields is None:
+        return jsonify({"error": "Unknown entity"}), 404
+    fmt = bulk_format()
+    if fmt not in ("ndjson", "csv"):
+        return jsonify({"error": "Unsupported format"}), 400
+
+    columns = ", ".join(f[0] for f in fields)
+    placeholders = ",".join("?" for _ in fields)
+    # Upsert rather than REPLACE so columns outside the bulk field list,
+    # like services.image_override, survive a re-import.
+    updates = ", ".join(f"{f[0]} = excluded.{f[0]}" for f in fields if f[0] != "id")
+    sql = f"INSERT INTO {entity} ({columns}) VALUES ({placeholders}) ON CONFLICT(id) DO UPDATE SET {updates}"
+
+    imported = 0
+    errors = []
+    error_count = 0
+    chunk = []
+
+    def record_error(row_num, message):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < BULK_MAX_ERRORS:
+            errors.append({"row": row_num, "error": message})
+
+    def flush():
+        nonlocal imported
+        failures = insert_bulk_chunk(sql, chunk)
+        imported += len(chunk) - len(failures)
+        for row_num, message in failures:
+            record_error(row_num, message)
+        chunk.clear()
+
+    try:
+        for row_num, record in iter_bulk_records(fmt):
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                chunk.append((row_num, validate_bulk_row(fields, record)))
+            except ValueError as e:
+                record_error(row_num, str(e))
+                continue
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                flush()
+        if chunk:
+            flush()
+    except (UnicodeDecodeError, csv.Error) as e:
+        record_error(None, f"Unreadable body: {e}")
+
+    return jsonify({
+        "imported": imported,
+        "errorCount": error_count,
+        "errors": errors,
+        "success": error_count == 0,
+    })
+
+
+@app.route("/api/admin/bulk/<entity>", methods=["GET"])
+def bulk_export(entity):
+    if not check_admin_auth():
+        return jsonify({"error": "Unauthorized"}), 401
+    fields = BULK_ENTITIES.get(entity)
+    if fields is None:
+        return jsonify({"error": "Unknown entity"}), 404
+    fmt = bulk_format()
+    if fmt not in ("ndjson", "csv"):
+        return jsonify({"error": "Unsupported format"}), 400
+
+    columns = ", ".join(f[0] for f in fields)
+    keys = [f[1] for f in fields]
+
+    def iter_rows():
+        # Keyset pagination keeps one page in memory and never holds a read
+        # transaction open across the whole export.
+        last_id = ""
+        while True:
+            conn = get_db()
+            rows = conn.execute(
+                f"SELECT {columns} FROM {entity} WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, BULK_CHUNK_SIZE)
+            ).fetchall()
+            conn.close()
+            if not rows:
+                return
+            for row in rows:
+                yield bulk_row_to_dict(fields, row)
+            last_id = rows[-1]["id"]
+
+    def generate_ndjson():
+        for d in iter_rows():
+            yield json.dumps(d) + "\n"
+
+    def generate_csv():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(keys)
+        for d in iter_rows():
+            writer.writerow(json.dumps(d[k]) if isinstance(d[k], list) else d[k] for k in keys)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        yield buf.getvalue()
+
+    if fmt == "csv":
+        body, mimetype = generate_csv(), "text/csv"
+    else:
+        body, mimetype = generate_ndjson(), "application/x-ndjson"
+    return Response(body, mimetype=mimetype, headers={
+        "Content-Disposition": f"attachment; filename={entity}.{fmt}",
+    })
+
+
 # ============ CHECKOUT ============
 
 @app.route("/api/orders/checkout", methods=["POST"])
@@ -610,29 +1636,28 @@ def checkout():
         total_amount = sum(float(item["price"]) * int(item["quantity"]) for item in items)
         order_id = str(uuid.uuid4())
 
-        conn = get_db()
-        conn.execute(
-            "INSERT INTO orders (id, customer_name, customer_email, customer_phone, total_amount, status) VALUES (?,?,?,?,?,?)",
-            (order_id, customer_name, customer_email, customer_phone, total_amount, "pending")
-        )
+        order_items = [
+            (str(uuid.uuid4()), order_id, item["productId"], item["productName"], item["quantity"], item["price"])
+            for item in items
+        ]
 
-        for item in items:
+        def insert_order(conn):
             conn.execute(
+                "INSERT INTO orders (id, customer_name, customer_email, customer_phone, total_amount, status) VALUES (?,?,?,?,?,?)",
+                (order_id, customer_name, customer_email, customer_phone, total_amount, "pending")
+            )
+            conn.executemany(
                 "INSERT INTO order_items (id, order_id, product_id, product_name, quantity, price) VALUES (?,?,?,?,?,?)",
-                (str(uuid.uuid4()), order_id, item["productId"], item["productName"], item["quantity"], item["price"])
+                order_items
             )
 
-        conn.commit()
-        conn.close()
+        db_write(insert_order)
 
         integration_id = os.environ.get("PAYNOW_INTEGRATION_ID")
         integration_key = os.environ.get("PAYNOW_INTEGRATION_KEY")
 
         if not integration_id or not integration_key:
-            conn = get_db()
-            conn.execute("UPDATE orders SET status = ? WHERE id = ?", ("pending_payment", order_id))
-            conn.commit()
-            conn.close()
+            db_execute("UPDATE orders SET status = ? WHERE id = ?", ("pending_payment", order_id))
             return jsonify({
                 "orderId": order_id,
                 "error": "Payment gateway not configured. Please contact us via WhatsApp to complete your order."
@@ -654,23 +1679,17 @@ def checkout():
             response = paynow.send(payment)
 
             if response.success:
-                conn = get_db()
-                conn.execute(
+                db_execute(
                     "UPDATE orders SET status = ?, poll_url = ?, paynow_reference = ? WHERE id = ?",
                     ("awaiting_payment", response.poll_url, response.poll_url, order_id)
                 )
-                conn.commit()
-                conn.close()
                 return jsonify({
                     "orderId": order_id,
                     "redirectUrl": response.redirect_url,
                     "pollUrl": response.poll_url,
                 })
             else:
-                conn = get_db()
-                conn.execute("UPDATE orders SET status = ? WHERE id = ?", ("payment_failed", order_id))
-                conn.commit()
-                conn.close()
+                db_execute("UPDATE orders SET status = ? WHERE id = ?", ("payment_failed", order_id))
                 return jsonify({
                     "orderId": order_id,
                     "error": response.error or "Payment initiation failed. Please try again.",
@@ -678,10 +1697,7 @@ def checkout():
 
         except Exception as e:
             print(f"Paynow error: {e}")
-            conn = get_db()
-            conn.execute("UPDATE orders SET status = ? WHERE id = ?", ("pending_payment", order_id))
-            conn.commit()
-            conn.close()
+            db_execute("UPDATE orders SET status = ? WHERE id = ?", ("pending_payment", order_id))
             return jsonify({
                 "orderId": order_id,
                 "error": "Payment gateway unavailable. Please contact us via WhatsApp to complete your order."
@@ -700,13 +1716,8 @@ def paynow_result():
         status = data.get("status", "unknown")
 
         if poll_url:
-            conn = get_db()
-            order = conn.execute("SELECT id FROM orders WHERE poll_url = ?", (poll_url,)).fetchone()
-            if order:
-                new_status = "paid" if status.lower() == "paid" else status.lower()
-                conn.execute("UPDATE orders SET status = ? WHERE id = ?", (new_status, order["id"]))
-                conn.commit()
-            conn.close()
+            new_status = "paid" if status.lower() == "paid" else status.lower()
+            db_execute("UPDATE orders SET status = ? WHERE poll_url = ?", (new_status, poll_url))
         return "", 200
     except Exception as e:
         print(f"Paynow result error: {e}")
@@ -717,6 +1728,9 @@ def paynow_result():
 def get_order_status(order_id):
     conn = get_db()
     order = conn.execute("SELECT * FROM orders WHERE id = ?", (order_id,)).fetchone()
+    if not order:
+        attach_archive(conn)
+        order = conn.execute("SELECT * FROM archive.orders WHERE id = ?", (order_id,)).fetchone()
     conn.close()
     if not order:
         return jsonify({"message": "Order not found"}), 404
@@ -734,10 +1748,7 @@ def get_order_status(order_id):
             )
             status = paynow.check_transaction_status(order_dict["poll_url"])
             if status.paid:
-                conn = get_db()
-                conn.execute("UPDATE orders SET status = ? WHERE id = ?", ("paid", order_id))
-                conn.commit()
-                conn.close()
+                db_execute("UPDATE orders SET status = ? WHERE id = ?", ("paid", order_id))
                 order_dict["status"] = "paid"
         except Exception as e:
             print(f"Poll error: {e}")
@@ -745,6 +1756,21 @@ def get_order_status(order_id):
     return jsonify({"status": order_dict["status"]})
 
 
+@app.route("/api/admin/orders/archive", methods=["POST"])
+def archive_orders():
+    if not check_admin_auth():
+        return jsonify({"error": "Unauthorized"}), 401
+
+    data = request.get_json(silent=True) or {}
+    older_than_days = data.get("olderThanDays", ARCHIVE_AFTER_DAYS)
+    try:
+        moved = archive_settled_orders(int(older_than_days))
+    except Exception as e:
+        print(f"Archive error: {e}")
+        return jsonify({"error": "Archive failed", "success": False}), 500
+    return jsonify({"archived": moved, "success": True})
+
+
 # ============ STATIC FILE SERVING ============
 
 DIST_DIR = os.path.join(os.path.dirname(__file__), "..", "dist", "public")
@@ -753,7 +1779,7 @@ PUBLIC_DIR = os.path.join(os.path.dirname(__file__), "..", "client", "public")
 
 @app.route("/uploads/<path:filename>")
 def serve_uploads(filename):
-    return send_from_directory(UPLOAD_DIR, filename)
+    return storage.serve(filename)
 
 
 @app.route("/images/<path:filename>")
@@ -800,6 +1826,7 @@ def serve_spa(path):
 # ============ STARTUP ============
 
 init_db()
+init_archive_db()
 seed_db()
 
 if __name__ == "__main__":
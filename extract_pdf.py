@@ -1,39 +1,218 @@
-import fitz
+"""Extract text and embedded images from PDF brochures.
+
+Usage:
+    python extract_pdf.py brochure.pdf [more.pdf ...] [-o pages.ndjson]
+
+Pages are extracted in a process pool and written as NDJSON, one record per
+page, in document and page order. Results are cached per file hash and page,
+so re-running over unchanged documents only reads the cache. Embedded images
+are written to the upload store (client/public/uploads) unless --no-images
+is given.
+"""
+import argparse
+import hashlib
 import json
+import os
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+UPLOAD_DIR = os.path.join(BASE_DIR, "client", "public", "uploads")
+CACHE_DIR = os.path.join(BASE_DIR, ".extract_cache")
+PAGES_PER_TASK = 8
+TASKS_PER_WORKER = 2
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(cache_dir, sha, page, image_dir):
+    suffix = ""
+    if image_dir:
+        suffix = "-img-" + hashlib.sha256(os.path.abspath(image_dir).encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, sha, f"{page}{suffix}.json")
+
+
+def load_cached(path, image_dir):
+    """Return a cached page record, or None if it is missing or stale."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        record = json.load(f)
+    # Images may have been cleaned out of the upload store since the page
+    # was cached; re-extract rather than hand out dangling URLs.
+    for url in record.get("images", []):
+        if not os.path.exists(os.path.join(image_dir, os.path.basename(url))):
+            return None
+    return record
+
+
+def save_image(doc, xref, sha, image_dir):
+    # Keyed on document and xref only: an image reused across pages (a logo
+    # in the footer, say) is the same xref and is stored once.
+    info = doc.extract_image(xref)
+    if not info or not info.get("image"):
+        return None
+    filename = f"pdf_{sha[:12]}_{xref}.{info.get('ext', 'png')}"
+    path = os.path.join(image_dir, filename)
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(info["image"])
+        os.replace(tmp_path, path)
+    return f"/uploads/{filename}"
+
+
+def extract_pages(path, sha, page_indexes, image_dir=None):
+    """Extract a run of pages from one document. Runs in a worker process."""
+    records = []
+    doc = fitz.open(path)
+    try:
+        for index in page_indexes:
+            page = doc[index]
+            images = []
+            if image_dir:
+                for image in page.get_images(full=True):
+                    url = save_image(doc, image[0], sha, image_dir)
+                    if url:
+                        images.append(url)
+            records.append({
+                "file": os.path.basename(path),
+                "sha256": sha,
+                "page": index + 1,
+                "text": page.get_text("text").strip(),
+                "images": images,
+            })
+    finally:
+        doc.close()
+    return records
+
+
+def plan_extraction(paths, workers, cache_dir, image_dir):
+    """Yield ("cached", record) and ("run", path, sha, pages) steps in output order.
+
+    Documents are hashed and checked against the cache lazily, so planning
+    the next document overlaps with extracting the current one. Uncached
+    pages are grouped into runs of consecutive pages sized so even a short
+    brochure is spread over every worker.
+    """
+    for path in paths:
+        sha = file_sha256(path)
+        with fitz.open(path) as doc:
+            page_count = doc.page_count
+        run_size = max(1, min(PAGES_PER_TASK, -(-page_count // workers)))
+        run = []
+        for index in range(page_count):
+            record = load_cached(cache_path(cache_dir, sha, index + 1, image_dir), image_dir)
+            if record is None:
+                run.append(index)
+                if len(run) >= run_size:
+                    yield ("run", path, sha, run)
+                    run = []
+                continue
+            if run:
+                yield ("run", path, sha, run)
+                run = []
+            yield ("cached", dict(record, file=os.path.basename(path), cached=True))
+        if run:
+            yield ("run", path, sha, run)
+
+
+def extract_pdfs(paths, workers=None, cache_dir=CACHE_DIR, image_dir=UPLOAD_DIR):
+    """Yield one record per page for every PDF in ``paths``.
+
+    Cached pages are yielded straight from the cache; the rest are extracted
+    in a process pool and cached as they arrive. Work for later pages and
+    documents is submitted ahead, up to ``TASKS_PER_WORKER`` runs per worker,
+    while records are still yielded in document and page order. Records carry
+    ``"cached": True`` when they came from the cache.
+    """
+    if image_dir:
+        os.makedirs(image_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * TASKS_PER_WORKER
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        plan = plan_extraction(paths, workers, cache_dir, image_dir)
+        pending = deque()
+        in_flight = 0
+        planned_all = False
+        while True:
+            while not planned_all and in_flight < max_in_flight:
+                step = next(plan, None)
+                if step is None:
+                    planned_all = True
+                    break
+                if step[0] == "run":
+                    _, path, sha, run = step
+                    step = ("run", sha, pool.submit(extract_pages, path, sha, run, image_dir))
+                    in_flight += 1
+                pending.append(step)
+                if len(pending) >= max_in_flight * PAGES_PER_TASK:
+                    break
+            if not pending:
+                return
 
-pdf_path = "attached_assets/dmac_1770840215393.pdf"
-output_path = "extracted_content.json"
-text_output_path = "extracted_content.txt"
+            step = pending.popleft()
+            if step[0] == "cached":
+                yield step[1]
+                continue
+            _, sha, future = step
+            in_flight -= 1
+            for record in future.result():
+                write_cache(cache_dir, sha, record, image_dir)
+                yield dict(record, cached=False)
 
-doc = fitz.open(pdf_path)
 
-pages = []
-full_text = []
+def write_cache(cache_dir, sha, record, image_dir):
+    path = cache_path(cache_dir, sha, record["page"], image_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(record, f)
+    os.replace(tmp_path, path)
 
-print(f"PDF has {len(doc)} pages")
-print("=" * 60)
 
-for i, page in enumerate(doc):
-    text = page.get_text("text")
-    pages.append({
-        "page": i + 1,
-        "text": text.strip()
-    })
-    if text.strip():
-        full_text.append(f"--- PAGE {i + 1} ---")
-        full_text.append(text.strip())
-        print(f"Page {i + 1}: {len(text)} chars")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract text and images from PDF brochures as NDJSON.")
+    parser.add_argument("pdfs", nargs="+", help="PDF files to extract")
+    parser.add_argument("-o", "--output", help="NDJSON output file (default: stdout)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="page cache directory")
+    parser.add_argument("--image-dir", default=UPLOAD_DIR, help="where embedded images are written")
+    parser.add_argument("--no-images", action="store_true", help="skip embedded image extraction")
+    args = parser.parse_args(argv)
 
-doc.close()
+    out = open(args.output, "w") if args.output else sys.stdout
+    pages = 0
+    cached = 0
+    chars = 0
+    try:
+        for record in extract_pdfs(
+            args.pdfs,
+            workers=args.workers,
+            cache_dir=args.cache_dir,
+            image_dir=None if args.no_images else args.image_dir,
+        ):
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            pages += 1
+            cached += record["cached"]
+            chars += len(record["text"])
+    finally:
+        if out is not sys.stdout:
+            out.close()
 
-with open(text_output_path, "w") as f:
-    f.write("\n\n".join(full_text))
+    print(f"{pages} pages from {len(args.pdfs)} PDF(s), {cached} from cache, {chars} chars", file=sys.stderr)
 
-with open(output_path, "w") as f:
-    json.dump(pages, f, indent=2)
 
-print("=" * 60)
-print(f"Text saved to {text_output_path}")
-print(f"JSON saved to {output_path}")
-print(f"Total text length: {sum(len(p['text']) for p in pages)} chars")
+if __name__ == "__main__":
+    main()
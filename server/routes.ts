@@ -8,7 +8,10 @@ let flaskProcess: ReturnType<typeof spawn> | null = null;
 function startFlask(): Promise<void> {
   return new Promise((resolve, reject) => {
     const flaskPort = "5001";
-    const env = { ...process.env, FLASK_PORT: flaskPort };
+    // proxyToFlask appends the caller's address to X-Forwarded-For, so
+    // Flask trusts one more hop than whatever sits in front of Express.
+    const trustedHops = parseInt(process.env.TRUSTED_PROXY_HOPS || "0", 10) + 1;
+    const env = { ...process.env, TRUSTED_PROXY_HOPS: String(trustedHops), FLASK_PORT: flaskPort };
 
     flaskProcess = spawn("python3", ["backend/app.py"], {
       env,
@@ -54,6 +57,9 @@ function startFlask(): Promise<void> {
 }
 
 function proxyToFlask(req: Request, res: Response) {
+  const forwardedFor = [req.headers["x-forwarded-for"], req.socket.remoteAddress]
+    .filter(Boolean)
+    .join(", ");
   const options: http.RequestOptions = {
     hostname: "127.0.0.1",
     port: 5001,
@@ -62,6 +68,7 @@ function proxyToFlask(req: Request, res: Response) {
     headers: {
       ...req.headers,
       host: "127.0.0.1:5001",
+      "x-forwarded-for": forwardedFor,
     },
   };
 